@@ -1,10 +1,16 @@
 import streamlit as st
-import requests
-import json
+import httpx
+import asyncio
+import queue
+import threading
+import orjson
 import os
+import time
 from datetime import datetime
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, WriteConcern
+from pymongo.errors import OperationFailure
 from bson.objectid import ObjectId
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import hashlib
 
 # --- Page Configuration ---
@@ -16,223 +22,506 @@ st.set_page_config(
 )
 
 # --- Constants ---
-OLLAMA_API_URL = "http://localhost:11434/api/chat"
 DEFAULT_MODEL = "llama3.2:1b"
+PREVIEW_LENGTH = 40
+RESUME_MESSAGE_LIMIT = 200
+HISTORY_RENDER_LIMIT = 50
+OLLAMA_RETRY_SECONDS = 30
+
+# Fields shared by every /api/chat request
+_PAYLOAD_BASE = {"stream": True}
+
+# Connect attempts are retried by the transport, so each one is kept short
+TAGS_TIMEOUT = httpx.Timeout(5, connect=1)
+CHAT_TIMEOUT = httpx.Timeout(30, connect=1)
+
+# Chat saves only need the primary's acknowledgement, not a journal flush
+CHAT_WRITE_CONCERN = WriteConcern(w=1, j=False)
+
+def get_secret(name, default=None):
+    """Read a setting from Streamlit secrets, falling back to environment variables"""
+    try:
+        return st.secrets.get(name, default)
+    except:
+        return os.getenv(name, default)
+
+# --- Async Helpers ---
+_STREAM_END = object()
+
+@st.cache_resource
+def get_event_loop():
+    """Start a background asyncio loop shared by all sessions"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+@st.cache_resource
+def get_http_client():
+    """Create the pooled async HTTP client used on the background loop"""
+    # Kept-alive connections are reused by model lookups and chat streams.
+    # Only failed or timed-out connection attempts are retried, never a request
+    # already sent; TAGS_TIMEOUT and CHAT_TIMEOUT bound each attempt.
+    transport = httpx.AsyncHTTPTransport(
+        retries=2,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+    )
+    return httpx.AsyncClient(transport=transport)
+
+def submit_in_background(coro):
+    """Schedule a coroutine on the background loop and return its future"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+def run_in_background(coro):
+    """Run a coroutine on the background loop and wait for its result"""
+    return submit_in_background(coro).result()
+
+def iterate_in_background(async_gen):
+    """
+    Drives an async generator on the background loop and yields its items
+    on the calling thread, so Streamlit can consume it as a plain generator.
+    Exceptions raised by the generator are re-raised here.
+    """
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in async_gen:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        finally:
+            items.put(_STREAM_END)
+
+    future = submit_in_background(pump())
+    try:
+        while (item := items.get()) is not _STREAM_END:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        future.cancel()
 
 # --- MongoDB Configuration ---
+async def connect_mongodb(mongo_uri):
+    """
+    Create the async MongoDB client and check the connection.
+    The client is bound to the loop it first runs on, so this must run on the
+    background loop like every other database call.
+    """
+    # One pooled client is shared by every session
+    client = AsyncMongoClient(
+        mongo_uri,
+        maxPoolSize=50,
+        minPoolSize=5,
+        serverSelectionTimeoutMS=3000,
+        appname="llm_chat_app",
+        compressors="zstd,snappy",
+    )
+    # Test connection
+    try:
+        await client.admin.command('ping')
+    except Exception:
+        await client.close()
+        raise
+    db = client.get_database("llm_chat_app")
+    return client, db, db.conversations
+
 @st.cache_resource
 def init_mongodb():
-    """Initialize MongoDB connection"""
+    """Initialize MongoDB connection and the conversations collection handle"""
     try:
-        # Get MongoDB URI from Streamlit secrets or environment variable
-        try:
-            mongo_uri = st.secrets.get("MONGODB_URI")
-        except:
-            mongo_uri = os.getenv("MONGODB_URI")
+        mongo_uri = get_secret("MONGODB_URI")
         
         if not mongo_uri:
             st.error("MongoDB URI not found. Please set MONGODB_URI in Streamlit secrets or environment variables.")
-            return None, None
+            return None, None, None
         
-        client = MongoClient(mongo_uri)
-        # Test connection
-        client.admin.command('ping')
-        db = client.get_database("llm_chat_app")
-        return client, db
+        client, db, conversations = run_in_background(connect_mongodb(mongo_uri))
+        ensure_indexes(conversations)
+        migrate_user_ids(conversations)
+        return client, db, conversations
     except Exception as e:
         st.error(f"Failed to connect to MongoDB: {e}")
-        return None, None
+        return None, None, None
+
+def ensure_indexes(conversations):
+    """Create the indexes used by the conversation queries"""
+    try:
+        # Lets the per-user history query ($match user_id, $sort created_at desc)
+        # walk the index in order instead of scanning and sorting in memory
+        run_in_background(conversations.create_index([("user_id", 1), ("created_at", -1)]))
+    except OperationFailure as e:
+        # Queries still work without the index, e.g. for a read-only database user
+        st.warning(f"Could not create conversation indexes: {e}")
+
+def migrate_user_ids(conversations):
+    """Move conversations saved under the old MD5-based user id to the current one"""
+    # session_id is never set, so every conversation was saved under the "default" id
+    legacy_user_id = hashlib.md5(b"default").hexdigest()[:16]
+    try:
+        run_in_background(
+            conversations.update_many({"user_id": legacy_user_id}, {"$set": {"user_id": compute_user_id()}})
+        )
+    except OperationFailure as e:
+        st.warning(f"Could not migrate saved conversations: {e}")
 
 # --- Database Helper Functions ---
-def get_user_id():
+def compute_user_id():
     """Generate a unique user ID based on session"""
-    if "user_id" not in st.session_state:
-        # Create a simple user identifier (in production, use proper authentication)
-        session_info = f"{st.session_state.get('session_id', 'default')}"
-        st.session_state.user_id = hashlib.md5(session_info.encode()).hexdigest()[:16]
-    return st.session_state.user_id
+    # Create a simple user identifier (in production, use proper authentication)
+    session_info = f"{st.session_state.get('session_id', 'default')}"
+    # An 8-byte digest is exactly 16 hex characters
+    return hashlib.blake2s(session_info.encode(), digest_size=8).hexdigest()
 
-def save_conversation_to_db(db, messages, model_used):
+def save_conversation_to_db(conversations, user_id, messages, model_used):
     """Save conversation to MongoDB"""
-    if db is None:
+    if conversations is None:
         return None
     
     try:
         conversation = {
-            "user_id": get_user_id(),
+            "user_id": user_id,
             "messages": messages,
             "model_used": model_used,
             "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow()
         }
         
-        result = db.conversations.insert_one(conversation)
+        # Stored once so history previews never have to scan `messages`
+        first_user = next((m["content"] for m in messages if m["role"] == "user"), None)
+        if first_user is not None:
+            conversation["preview"] = first_user[:PREVIEW_LENGTH]
+            conversation["preview_truncated"] = len(first_user) > PREVIEW_LENGTH
+        
+        result = run_in_background(conversations.insert_one(conversation))
         return str(result.inserted_id)
     except Exception as e:
         st.error(f"Error saving conversation: {e}")
         return None
 
-def update_conversation_in_db(db, conversation_id, messages):
-    """Update existing conversation in MongoDB"""
-    if db is None or not conversation_id:
+def append_messages_update(new_messages):
+    """Build the update document that appends messages to a conversation"""
+    return {
+        "$push": {"messages": {"$each": new_messages}},
+        "$set": {"updated_at": datetime.utcnow()}
+    }
+
+def update_conversation_in_db(conversations, conversation_id, new_messages):
+    """Append messages not yet persisted to an existing conversation in MongoDB"""
+    if conversations is None or not conversation_id:
         return False
     
+    if not new_messages:
+        return True
+    
     try:
-        db.conversations.update_one(
-            {"_id": ObjectId(conversation_id)},
-            {
-                "$set": {
-                    "messages": messages,
-                    "updated_at": datetime.utcnow()
-                }
-            }
+        run_in_background(
+            conversations.with_options(write_concern=CHAT_WRITE_CONCERN).update_one(
+                {"_id": ObjectId(conversation_id)},
+                append_messages_update(new_messages)
+            )
         )
         return True
     except Exception as e:
         st.error(f"Error updating conversation: {e}")
         return False
 
-def load_conversation_history(db, limit=20):
-    """Load conversation history from MongoDB"""
-    if db is None:
+async def autosave_conversation(conversations, conversation_id, new_messages, previous=None):
+    """
+    Append new messages once the session's previous auto-save is acknowledged.
+    Runs on the background loop without being awaited; settle_autosaves reports the outcome.
+    """
+    if previous is not None:
+        # A failed earlier save raises here too, so later turns are never stored ahead of it
+        await asyncio.wrap_future(previous)
+    await conversations.with_options(write_concern=CHAT_WRITE_CONCERN).update_one(
+        {"_id": ObjectId(conversation_id)},
+        append_messages_update(new_messages)
+    )
+
+def settle_autosaves(wait=False):
+    """Count auto-saved messages as persisted once MongoDB has acknowledged them"""
+    pending = st.session_state.pending_autosaves
+    while pending and (wait or pending[0][0].done()):
+        future, persisted_count = pending.pop(0)
+        try:
+            future.result()
+        except Exception as e:
+            # Later auto-saves fail with this one, so their messages are resent too
+            pending.clear()
+            st.warning(f"Auto-save failed, unsaved messages will be sent again: {e}")
+            return
+        st.session_state.persisted_msg_count = persisted_count
+
+async def load_conversation_history(conversations, user_id, limit=20):
+    """Load conversation history from MongoDB with display-ready previews"""
+    if conversations is None:
         return []
     
-    try:
-        conversations = db.conversations.find(
-            {"user_id": get_user_id()},
-            {"_id": 1, "messages": 1, "model_used": 1, "created_at": 1}
-        ).sort("created_at", -1).limit(limit)
-        
-        return list(conversations)
-    except Exception as e:
-        st.error(f"Error loading conversation history: {e}")
-        return []
+    user_contents = {
+        "$map": {
+            "input": {"$filter": {"input": "$messages", "as": "m", "cond": {"$eq": ["$$m.role", "user"]}}},
+            "as": "m",
+            "in": "$$m.content",
+        }
+    }
+    pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$sort": {"created_at": -1}},
+        {"$limit": limit},
+        {
+            "$project": {
+                "created_at": 1,
+                "preview_truncated": 1,
+                # Conversations saved before `preview` was stored fall back to their first user message
+                "preview": {"$ifNull": ["$preview", {"$ifNull": [{"$arrayElemAt": [user_contents, 0]}, ""]}]},
+            }
+        },
+        {
+            "$set": {
+                "preview": {
+                    "$cond": [
+                        {"$eq": ["$preview", ""]},
+                        "New Conversation",
+                        {
+                            "$concat": [
+                                # Code points rather than bytes, so multi-byte text is never split
+                                {"$substrCP": ["$preview", 0, PREVIEW_LENGTH]},
+                                {
+                                    "$cond": [
+                                        {"$or": ["$preview_truncated", {"$gt": [{"$strLenCP": "$preview"}, PREVIEW_LENGTH]}]},
+                                        "...",
+                                        "",
+                                    ]
+                                },
+                            ]
+                        },
+                    ]
+                }
+            }
+        },
+    ]
+    # A single batch returns every row, so draining the cursor never goes back to the server
+    cursor = await conversations.aggregate(pipeline, batchSize=limit)
+    return await cursor.to_list(None)
 
-def load_conversation_by_id(db, conversation_id):
-    """Load a specific conversation by ID"""
-    if db is None:
+def load_conversation_by_id(conversations, user_id, conversation_id, full_transcript=False):
+    """
+    Load a specific conversation by ID.
+    Only the last RESUME_MESSAGE_LIMIT messages are fetched unless full_transcript is set.
+    """
+    if conversations is None:
         return None
     
     try:
-        conversation = db.conversations.find_one(
-            {"_id": ObjectId(conversation_id), "user_id": get_user_id()}
+        # One message past the limit tells whether older ones were left behind
+        messages_projection = 1 if full_transcript else {"$slice": -(RESUME_MESSAGE_LIMIT + 1)}
+        conversation = run_in_background(
+            conversations.find_one(
+                {"_id": ObjectId(conversation_id), "user_id": user_id},
+                {"messages": messages_projection, "model_used": 1, "created_at": 1}
+            )
         )
+        if conversation and not full_transcript:
+            messages = conversation.get("messages", [])
+            conversation["truncated"] = len(messages) > RESUME_MESSAGE_LIMIT
+            conversation["messages"] = messages[-RESUME_MESSAGE_LIMIT:]
         return conversation
     except Exception as e:
         st.error(f"Error loading conversation: {e}")
         return None
 
-def delete_conversation(db, conversation_id):
-    """Delete a conversation"""
-    if db is None:
-        return False
+def delete_conversation(conversations, user_id, conversation_id):
+    """
+    Delete a conversation.
+    Returns the deleted document so it can be restored, or None if nothing was deleted.
+    """
+    if conversations is None:
+        return None
     
     try:
-        result = db.conversations.delete_one(
-            {"_id": ObjectId(conversation_id), "user_id": get_user_id()}
+        return run_in_background(
+            conversations.find_one_and_delete(
+                {"_id": ObjectId(conversation_id), "user_id": user_id}
+            )
         )
-        return result.deleted_count > 0
     except Exception as e:
         st.error(f"Error deleting conversation: {e}")
+        return None
+
+def restore_conversation(conversations, conversation):
+    """Re-insert a deleted conversation with its original ID"""
+    if conversations is None:
+        return False
+    
+    try:
+        run_in_background(conversations.insert_one(conversation))
+        return True
+    except Exception as e:
+        st.error(f"Error restoring conversation: {e}")
         return False
 
 # --- Helper Functions ---
+@st.cache_resource
+def get_config():
+    """Resolve the Ollama endpoints once from Streamlit secrets or environment variable"""
+    # For deployment, you might want to use a remote Ollama instance
+    ollama_url = get_secret("OLLAMA_URL", "http://localhost:11434")
+    return {
+        "ollama_url": ollama_url,
+        "api_chat_url": f"{ollama_url}/api/chat",
+        "api_tags_url": f"{ollama_url}/api/tags",
+    }
+
+@st.cache_data(ttl=60, show_spinner=False)
 def get_installed_models():
     """
     Fetches the list of locally installed Ollama models.
-    Returns a list of model names or an empty list if it fails.
+    Raises httpx.HTTPError if Ollama cannot be reached, or ValueError if the
+    reply is not JSON; failures are not cached.
+    """
+    response = run_in_background(get_http_client().get(get_config()["api_tags_url"], timeout=TAGS_TIMEOUT))
+    response.raise_for_status()
+    models_data = response.json()
+    return [model['name'] for model in models_data.get('models', [])]
+
+def get_available_models():
+    """
+    Returns the installed models, or an empty list if Ollama is unreachable.
+    After a failed lookup, further lookups are skipped for OLLAMA_RETRY_SECONDS
+    so reruns don't each wait for the request to time out.
     """
+    if time.monotonic() < st.session_state.get("_ollama_down_until", 0):
+        st.sidebar.warning("Could not connect to Ollama. Please ensure Ollama is running.")
+        return []
+    
     try:
-        # For deployment, you might want to use a remote Ollama instance
-        try:
-            ollama_url = st.secrets.get("OLLAMA_URL", "http://localhost:11434")
-        except:
-            ollama_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
-        
-        response = requests.get(f"{ollama_url}/api/tags", timeout=5)
-        response.raise_for_status()
-        models_data = response.json()
-        return [model['name'] for model in models_data.get('models', [])]
-    except requests.exceptions.RequestException as e:
+        return get_installed_models()
+    except (httpx.HTTPError, ValueError) as e:
+        st.session_state._ollama_down_until = time.monotonic() + OLLAMA_RETRY_SECONDS
         st.sidebar.error(f"Error fetching models: {e}")
         st.sidebar.warning("Could not connect to Ollama. Please ensure Ollama is running.")
         return []
 
-def generate_response(model, messages):
+async def aiter_ndjson_lines(response):
     """
-    Sends a request to the Ollama /api/chat endpoint and streams the response.
-    Yields each content token as it is received.
+    Yields raw NDJSON lines as bytes from a streamed response.
+    Splitting the byte chunks directly skips the text decoding done by
+    aiter_lines(); orjson parses the bytes as-is.
     """
-    try:
-        try:
-            ollama_url = st.secrets.get("OLLAMA_URL", "http://localhost:11434")
-        except:
-            ollama_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
-        
-        api_url = f"{ollama_url}/api/chat"
-        
-        payload = {
-            "model": model,
-            "messages": messages,
-            "stream": True,
-        }
+    pending = b""
+    async for chunk in response.aiter_bytes():
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+async def stream_chat(client, api_chat_url, model, messages):
+    """
+    Streams a chat completion from the Ollama /api/chat endpoint.
+    Yields each content token, or None for a line that could not be parsed.
+    Runs on the background loop, so it must not touch Streamlit APIs.
+    """
+    payload = {**_PAYLOAD_BASE, "model": model, "messages": messages}
 
-        response = requests.post(
-            api_url,
-            json=payload,
-            stream=True,
-            headers={"Content-Type": "application/json"},
-            timeout=30
-        )
+    async with client.stream("POST", api_chat_url, json=payload, timeout=CHAT_TIMEOUT) as response:
         response.raise_for_status()
-
-        full_response = ""
-        for line in response.iter_lines():
+        async for line in aiter_ndjson_lines(response):
             if line:
                 try:
-                    json_line = json.loads(line.decode('utf-8'))
-                    if 'message' in json_line and 'content' in json_line['message']:
-                        token = json_line['message']['content']
-                        full_response += token
-                        yield token
-                except json.JSONDecodeError:
-                    st.error("Failed to parse a response line from the model.")
+                    json_line = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    yield None
                     continue
+                if 'message' in json_line and 'content' in json_line['message']:
+                    yield json_line['message']['content']
+
+def generate_response(model, messages):
+    """
+    Sends a request to the Ollama /api/chat endpoint and streams the response.
+    Yields each content token as it is received.
+    """
+    try:
+        chat_stream = stream_chat(get_http_client(), get_config()["api_chat_url"], model, messages)
+
+        parts = []
+        for token in iterate_in_background(chat_stream):
+            if token is None:
+                st.error("Failed to parse a response line from the model.")
+                continue
+            parts.append(token)
+            yield token
 
         # Save assistant response to session
-        st.session_state.messages.append({"role": "assistant", "content": full_response})
+        st.session_state.messages.append({"role": "assistant", "content": "".join(parts)})
 
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         st.error("Connection Error: Could not connect to the Ollama API.")
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         st.error(f"An API request error occurred: {e}")
 
 # --- Main App ---
 def main():
     # Initialize MongoDB
-    client, db = init_mongodb()
+    client, db, conversations = init_mongodb()
     
     # --- Session State Initialization ---
+    if "user_id" not in st.session_state:
+        st.session_state.user_id = compute_user_id()
+    user_id = st.session_state.user_id
+    
     if "messages" not in st.session_state:
         st.session_state.messages = []
     
     if "current_conversation_id" not in st.session_state:
         st.session_state.current_conversation_id = None
     
+    # Number of messages already stored in the current conversation
+    if "persisted_msg_count" not in st.session_state:
+        st.session_state.persisted_msg_count = 0
+    
+    # (future, persisted_msg_count once acknowledged) for each auto-save in flight
+    if "pending_autosaves" not in st.session_state:
+        st.session_state.pending_autosaves = []
+    
+    # Whether older messages of the current conversation were left unloaded
+    if "transcript_truncated" not in st.session_state:
+        st.session_state.transcript_truncated = False
+    
+    # Whether messages older than HISTORY_RENDER_LIMIT are drawn
+    if "show_all_messages" not in st.session_state:
+        st.session_state.show_all_messages = False
+    
     if "selected_model" not in st.session_state:
         st.session_state.selected_model = DEFAULT_MODEL
 
+    settle_autosaves()
+
     # Handle conversation loading
     if "load_conversation" in st.session_state:
+        # In-flight auto-saves must land before the transcript is read back
+        settle_autosaves(wait=True)
         conversation_id = st.session_state.load_conversation
-        conversation = load_conversation_by_id(db, conversation_id)
+        full_transcript = st.session_state.pop("load_full_transcript", False)
+        conversation = load_conversation_by_id(conversations, user_id, conversation_id, full_transcript)
         if conversation:
             st.session_state.messages = conversation["messages"]
             st.session_state.current_conversation_id = conversation_id
+            st.session_state.persisted_msg_count = len(conversation["messages"])
+            st.session_state.transcript_truncated = conversation.get("truncated", False)
+            st.session_state.show_all_messages = full_transcript
+            # Undoing an older delete would replace the conversation just opened
+            st.session_state.pop("deleted_conversation", None)
             st.session_state.selected_model = conversation.get("model_used", DEFAULT_MODEL)
         del st.session_state["load_conversation"]
         st.rerun()
 
+    # Start loading the sidebar history while the rest of the page renders
+    if conversations is not None:
+        history_future = submit_in_background(load_conversation_history(conversations, user_id))
+
     # --- Sidebar ---
     with st.sidebar:
         st.title("👽 LLM Chat")
@@ -242,7 +531,7 @@ def main():
             st.balloons()
 
         # Model Selection
-        installed_models = get_installed_models()
+        installed_models = get_available_models()
         if installed_models:
             model_index = 0
             if st.session_state.selected_model in installed_models:
@@ -263,61 +552,95 @@ def main():
             st.session_state.selected_model = selected_model
             st.markdown("_(Could not fetch model list. Enter model name manually)_")
 
+        if st.button("🔃 Refresh Models", use_container_width=True):
+            get_installed_models.clear()
+            st.session_state.pop("_ollama_down_until", None)
+            st.rerun()
+
         st.markdown("---")
 
         # Save Current Conversation
-        if db is not None:
+        if conversations is not None:
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("💾 Save Chat", use_container_width=True):
+                    settle_autosaves(wait=True)
                     if st.session_state.current_conversation_id:
+                        new_messages = st.session_state.messages[st.session_state.persisted_msg_count:]
                         success = update_conversation_in_db(
-                            db, 
+                            conversations, 
                             st.session_state.current_conversation_id, 
-                            st.session_state.messages
+                            new_messages
                         )
                         if success:
+                            st.session_state.persisted_msg_count += len(new_messages)
                             st.success("Conversation updated!")
                     else:
                         conversation_id = save_conversation_to_db(
-                            db, 
+                            conversations, 
+                            user_id,
                             st.session_state.messages, 
                             st.session_state.selected_model
                         )
                         if conversation_id:
                             st.session_state.current_conversation_id = conversation_id
+                            st.session_state.pop("deleted_conversation", None)
+                            st.session_state.persisted_msg_count = len(st.session_state.messages)
                             st.success("Conversation saved!")
+                            # Reload so the new conversation shows up in the history below
+                            history_future = submit_in_background(
+                                load_conversation_history(conversations, user_id)
+                            )
             
             with col2:
                 if st.button("🗑️ Delete", use_container_width=True):
+                    settle_autosaves(wait=True)
                     if st.session_state.current_conversation_id:
-                        success = delete_conversation(db, st.session_state.current_conversation_id)
-                        if success:
+                        deleted = delete_conversation(
+                            conversations,
+                            user_id,
+                            st.session_state.current_conversation_id
+                        )
+                        if deleted:
+                            st.session_state.deleted_conversation = deleted
                             st.session_state.messages = []
                             st.session_state.current_conversation_id = None
+                            st.session_state.persisted_msg_count = 0
+                            st.session_state.transcript_truncated = False
+                            st.session_state.show_all_messages = False
                             st.success("Conversation deleted!")
                             st.rerun()
 
+            # Undo the last delete in this session
+            if "deleted_conversation" in st.session_state:
+                if st.button("↩️ Undo Delete", use_container_width=True):
+                    deleted = st.session_state.deleted_conversation
+                    if restore_conversation(conversations, deleted):
+                        del st.session_state["deleted_conversation"]
+                        st.session_state.load_conversation = str(deleted["_id"])
+                        st.rerun()
+
         st.markdown("---")
 
         # Chat History
         st.markdown("### 📜 Chat History")
-        if db is not None:
-            conversations = load_conversation_history(db)
-            if conversations:
-                for conv in conversations:
-                    # Get first user message as preview
-                    preview = "New Conversation"
-                    for msg in conv.get("messages", []):
-                        if msg["role"] == "user":
-                            preview = msg["content"][:40] + ("..." if len(msg["content"]) > 40 else "")
-                            break
-                    
+        if conversations is not None:
+            try:
+                history = history_future.result(timeout=2)
+            except FutureTimeoutError:
+                st.warning("Chat history is taking too long to load.")
+                history = []
+            except Exception as e:
+                st.error(f"Error loading conversation history: {e}")
+                history = []
+            
+            if history:
+                for conv in history:
                     # Format date
                     date_str = conv["created_at"].strftime("%m/%d %H:%M")
                     
                     if st.button(
-                        f"💬 {preview}\n📅 {date_str}", 
+                        f"💬 {conv['preview']}\n📅 {date_str}", 
                         key=f"load_{conv['_id']}",
                         use_container_width=True
                     ):
@@ -332,15 +655,20 @@ def main():
 
         # Reset Conversation
         if st.button("🔄 New Chat", use_container_width=True):
+            settle_autosaves(wait=True)
             st.session_state.messages = []
             st.session_state.current_conversation_id = None
+            st.session_state.persisted_msg_count = 0
+            st.session_state.transcript_truncated = False
+            st.session_state.show_all_messages = False
+            st.session_state.pop("deleted_conversation", None)
             st.success("Started new conversation.")
             st.rerun()
 
         st.markdown("---")
         
         # Connection Status
-        if db is not None:
+        if conversations is not None:
             st.success("🟢 Database Connected")
         else:
             st.error("🔴 Database Disconnected")
@@ -354,12 +682,29 @@ def main():
         )
 
     # --- Main Chat Display ---
-    for message in st.session_state.messages:
+    if st.session_state.transcript_truncated:
+        if st.button("📜 Load full transcript"):
+            st.session_state.load_conversation = st.session_state.current_conversation_id
+            st.session_state.load_full_transcript = True
+            st.rerun()
+
+    # Long transcripts only draw their most recent messages on each rerun
+    hidden_count = 0
+    if not st.session_state.show_all_messages:
+        hidden_count = max(len(st.session_state.messages) - HISTORY_RENDER_LIMIT, 0)
+    if hidden_count:
+        if st.button(f"⬆️ Show {hidden_count} earlier messages"):
+            st.session_state.show_all_messages = True
+            st.rerun()
+
+    for message in st.session_state.messages[hidden_count:]:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
     # --- Chat Input ---
     if prompt := st.chat_input("What would you like to ask?"):
+        # Undoing the delete now would discard the chat being typed
+        st.session_state.pop("deleted_conversation", None)
         st.session_state.messages.append({"role": "user", "content": prompt})
 
         with st.chat_message("user"):
@@ -373,12 +718,23 @@ def main():
             st.write_stream(response_generator)
         
         # Auto-save after each exchange if conversation exists
-        if db is not None and st.session_state.current_conversation_id:
-            update_conversation_in_db(
-                db, 
-                st.session_state.current_conversation_id, 
-                st.session_state.messages
-            )
+        if conversations is not None and st.session_state.current_conversation_id:
+            pending = st.session_state.pending_autosaves
+            # Messages of auto-saves still in flight are not sent twice
+            sent_count = pending[-1][1] if pending else st.session_state.persisted_msg_count
+            new_messages = st.session_state.messages[sent_count:]
+            if new_messages:
+                # Not awaited; each auto-save is chained onto the previous one,
+                # since $push must apply the turns in order
+                future = submit_in_background(
+                    autosave_conversation(
+                        conversations,
+                        st.session_state.current_conversation_id,
+                        new_messages,
+                        pending[-1][0] if pending else None
+                    )
+                )
+                pending.append((future, len(st.session_state.messages)))
 
 # --- Custom CSS ---
 st.markdown("""